@@ -14,60 +14,101 @@ from config import CAMERA_STREAMS, APP_SETTINGS, DETECTION_SETTINGS
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'rtsp_streaming_secret_key'
+app.config['USE_X_SENDFILE'] = APP_SETTINGS["use_x_sendfile"]
 
-# Initialize SocketIO with async mode
-socketio = SocketIO(app, async_mode='eventlet', ping_timeout=APP_SETTINGS["socket_timeout"])
+# Initialize SocketIO with real threads so encoding and detection don't serialize behind greenlets
+socketio = SocketIO(app, async_mode='threading', ping_timeout=APP_SETTINGS["socket_timeout"])
 
 # Initialize stream manager
 stream_manager = StreamManager()
 
 # Ensure snapshot directory exists
 os.makedirs(APP_SETTINGS["snapshot_dir"], exist_ok=True)
+stream_manager.load_snapshot_index(APP_SETTINGS["snapshot_dir"])
 
 # Flag to control the background thread
 thread_running = False
 thread_lock = threading.Lock()
+# Set when a client connects so the current frame of every camera is sent again
+resend_frames = threading.Event()
+
+# Limit frames per second for browser performance
+STREAM_FPS_LIMIT = 10
 
 def background_thread():
     """Background thread to emit camera frames to clients"""
     global thread_running
-    fps_limit = 10  # Limit frames per second for browser performance
-    frame_interval = 1.0 / fps_limit
+    frame_interval = 1.0 / STREAM_FPS_LIMIT
+    frames_available = stream_manager.frame_event
+    # Bind hot-path lookups to locals once
+    emit_event = socketio.emit
+    get_cameras = stream_manager.get_all_cameras_fast
     last_frame_time = {}
+    last_frame_seq = {}
+    last_status_version = None
+    next_tick = time.time()
 
     while thread_running:
+        # Emit on a fixed tick so every camera's new frame goes out in the same batch
+        next_tick += frame_interval
+        current_time = time.time()
+        if next_tick < current_time:
+            # Fell behind; start a fresh tick rather than bursting to catch up
+            next_tick = current_time
+            
+        # Wait for any camera to publish, then sleep out the rest of the tick
+        has_frames = frames_available.wait(timeout=next_tick - current_time)
+        remaining = next_tick - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        frames_available.clear()
+        if resend_frames.is_set():
+            resend_frames.clear()
+            last_frame_seq.clear()
+            has_frames = True
+        
         # Get current time
         current_time = time.time()
         
-        # Process each camera
-        for camera in stream_manager.get_all_cameras():
-            # Check if enough time has passed since the last frame
-            if camera.name not in last_frame_time or (current_time - last_frame_time[camera.name]) >= frame_interval:
-                # Get frame with object detection
-                frame = camera.get_frame(with_detection=True)
-                
-                # Convert to base64
-                frame_base64 = FrameProcessor.frame_to_base64(frame)
+        # Collect every new frame into one multiplexed message
+        frames = {}
+        connected = {}
+        
+        # Sweep every camera whose frame changed since the last tick (none published if not has_frames)
+        cameras = get_cameras() if has_frames else ()
+        for camera in cameras:
+            # Skip cameras without a new frame so the previous one isn't re-encoded
+            seq = camera.processed_seq
+            if last_frame_seq.get(camera.name) == seq:
+                continue
                 
-                # Emit the frame through SocketIO if valid
-                if frame_base64:
-                    socketio.emit('camera_frame', {
-                        'camera_name': camera.name,
-                        'frame': frame_base64,
-                        'connected': camera.is_connected(),
-                        'timestamp': current_time
-                    }, namespace='/stream')
-                    
-                    # Update last frame time
-                    last_frame_time[camera.name] = current_time
+            # Get frame with object detection
+            frame = camera.get_frame(with_detection=True)
+            
+            # Encode to raw JPEG bytes (sent as a binary attachment, no base64)
+            jpeg_bytes = FrameProcessor.frame_to_jpeg_bytes(frame, camera.jpeg_quality)
+            
+            # Add the frame to the batch if valid
+            if jpeg_bytes:
+                frames[camera.name] = jpeg_bytes
+                connected[camera.name] = camera.is_connected()
+                last_frame_seq[camera.name] = seq
         
-        # Emit camera status every 5 seconds
+        # Emit all frames for this tick through SocketIO at once
+        if frames:
+            emit_event('camera_frames_batch', {
+                'ts': current_time,
+                'frames': frames,
+                'connected': connected
+            }, namespace='/stream')
+            
+        # Check camera status every 5 seconds, emitting only when it changed
         if 'status_time' not in last_frame_time or (current_time - last_frame_time['status_time']) >= 5:
-            socketio.emit('camera_status', stream_manager.get_camera_status(), namespace='/stream')
+            status = stream_manager.get_camera_status()
+            if stream_manager.status_version != last_status_version:
+                emit_event('camera_status', status, namespace='/stream')
+                last_status_version = stream_manager.status_version
             last_frame_time['status_time'] = current_time
-            
-        # Sleep to avoid high CPU usage
-        socketio.sleep(0.01)
 
 @app.route('/')
 def index():
@@ -80,17 +121,31 @@ def index():
 def stream(camera_name):
     """Route for MJPEG streaming of a specific camera (fallback for non-websocket browsers)"""
     def generate():
+        frame_interval = 1.0 / STREAM_FPS_LIMIT
+        last_seq = -1
         while True:
             camera = stream_manager.get_camera(camera_name)
-            if camera:
-                frame = camera.get_frame(with_detection=True)
-                if frame is not None:
-                    jpeg_data = FrameProcessor.frame_to_jpeg_response(frame)
-                    if jpeg_data:
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + jpeg_data + b'\r\n\r\n')
-            # Limit framerate
-            time.sleep(0.1)
+            if not camera:
+                time.sleep(0.5)
+                continue
+                
+            # Block until a new frame exists instead of re-encoding the previous one
+            last_seq, frame = camera.wait_for_frame(last_seq, timeout=0.5)
+            if frame is None:
+                continue
+                
+            sent_time = time.time()
+            jpeg_data = FrameProcessor.frame_to_jpeg_response(frame, camera.jpeg_quality)
+            if jpeg_data:
+                # Yield header, payload and trailer separately so the JPEG isn't concatenated
+                yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+                yield jpeg_data
+                yield b'\r\n\r\n'
+                
+            # Bound the framerate; frames published meanwhile are dropped in favour of the latest
+            remaining = frame_interval - (time.time() - sent_time)
+            if remaining > 0:
+                time.sleep(remaining)
             
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
@@ -107,22 +162,15 @@ def take_snapshot(camera_name):
 @app.route('/snapshots/<filename>')
 def get_snapshot(filename):
     """Route for accessing saved snapshots"""
-    return send_from_directory(APP_SETTINGS["snapshot_dir"], filename)
+    # Snapshot names are unique (millisecond timestamp) and never rewritten, so let browsers cache them aggressively
+    return send_from_directory(APP_SETTINGS["snapshot_dir"], filename,
+                               conditional=True, etag=True,
+                               max_age=APP_SETTINGS["snapshot_max_age"])
 
 @app.route('/snapshots')
 def list_snapshots():
     """Route for listing all saved snapshots"""
-    snapshots = []
-    if os.path.exists(APP_SETTINGS["snapshot_dir"]):
-        for filename in os.listdir(APP_SETTINGS["snapshot_dir"]):
-            if filename.endswith('.jpg'):
-                filepath = os.path.join(APP_SETTINGS["snapshot_dir"], filename)
-                snapshots.append({
-                    'filename': filename,
-                    'timestamp': os.path.getmtime(filepath),
-                    'url': f'/snapshots/{filename}'
-                })
-    return jsonify(snapshots)
+    return jsonify(stream_manager.snapshot_index)
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -151,8 +199,8 @@ def settings():
             
         return jsonify({'success': success, 'message': message})
     else:
-        # Return current settings
-        return jsonify(stream_manager.get_camera_status())
+        # Return current settings from the cached JSON
+        return Response(stream_manager.get_camera_status_json(), mimetype='application/json')
 
 @socketio.on('connect', namespace='/stream')
 def socket_connect():
@@ -165,6 +213,10 @@ def socket_connect():
             thread_running = True
             socketio.start_background_task(target=background_thread)
     
+    # Make sure the new client receives a frame from every camera, even static ones
+    resend_frames.set()
+    stream_manager.frame_event.set()
+    
     # Send initial camera status
     emit('camera_status', stream_manager.get_camera_status())
 
@@ -189,4 +241,5 @@ if __name__ == '__main__':
                 host=APP_SETTINGS["host"], 
                 port=APP_SETTINGS["port"], 
                 debug=APP_SETTINGS["debug"],
-                use_reloader=False)  # Disable reloader to avoid duplicate camera threads 
\ No newline at end of file
+                use_reloader=False,  # Disable reloader to avoid duplicate camera threads
+                allow_unsafe_werkzeug=APP_SETTINGS["allow_unsafe_werkzeug"]) 
\ No newline at end of file
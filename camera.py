@@ -6,8 +6,35 @@ import time
 import threading
 import cv2
 import numpy as np
-from ultralytics import YOLO
 from config import CAPTURE_SETTINGS, DETECTION_SETTINGS
+from overlay import draw_box, get_label_sprite, paste_sprite
+from decoder import HWDecodeCapture, HWDecodeUnavailable
+
+def _render_status_frame(resolution, lines, color):
+    """Render a black frame with status text lines centered vertically"""
+    frame = np.zeros((resolution[1], resolution[0], 3), dtype=np.uint8)
+    for text, offset in lines:
+        cv2.putText(frame, text, (30, resolution[1]//2 + offset),
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+    return frame
+
+# Size of the thumbnail used for the cheap motion estimate
+MOTION_SIZE = (80, 60)
+
+# Size of the grayscale thumbnail used to decide whether a scene changed since the last detection
+SCENE_SIZE = (64, 48)
+
+# Detections are stored as parallel arrays (one row per box) rather than a list of dicts
+EMPTY_DETECTIONS = {
+    "bbox": np.empty((0, 4), dtype=np.int32),
+    "conf": np.empty(0, dtype=np.float32),
+    "cls": np.empty(0, dtype=np.int32),
+    "names": {}
+}
+
+# Rendered once; per-camera error frames copy it and only add the camera name
+ERROR_FRAME_TEMPLATE = _render_status_frame(CAPTURE_SETTINGS["resolution"],
+                                            [("Attempting to reconnect...", 30)], (0, 0, 255))
 
 class Camera:
     """
@@ -17,35 +44,98 @@ class Camera:
         self.name = name
         self.url = url
         self.cap = None
-        self.frame = None
+        self._latest = None
+        self._latest_seq = 0
         self.processed_frame = None
+        self.processed_seq = 0
+        self.on_frame = None
         self.last_frame_time = 0
-        self.connected = False
+        self.on_status_change = None
+        self._connected = False
         self.running = False
         self.detection_enabled = detection_enabled
-        self.detection_model = None
         self.confidence_threshold = DETECTION_SETTINGS["confidence_threshold"]
         self.resolution = CAPTURE_SETTINGS["resolution"]
         self.reconnect_delay = CAPTURE_SETTINGS["reconnect_delay"]
         self.frame_count = 0
+        self.grab_count = 0
+        self.keep_every = 1
+        self._use_hwdecode = CAPTURE_SETTINGS["hw_decode"] is not None
+        self.jpeg_quality = CAPTURE_SETTINGS["jpeg_quality"]
+        self._motion_small = None
+        self._static_since = None
         self.refresh_interval = DETECTION_SETTINGS["refresh_interval"]
         self.lock = threading.Lock()
+        # Single-slot mailbox: the decode thread overwrites _latest, the overlay thread waits on it
+        self._frame_cond = threading.Condition(self.lock)
+        # Signalled whenever a new processed frame is published
+        self._processed_cond = threading.Condition(self.lock)
         self.thread = None
-        self.detections = []
+        self.overlay_thread = None
+        self.detections = EMPTY_DETECTIONS
+        self._ref_small = None
+        self._pending_small = None
+        # Bumped by settings changes so results from a batch already in flight are discarded
+        self._detection_generation = 0
+        self._pending_generation = 0
+        
+        # Status frames rendered once, published by reference and never mutated afterwards
+        height = self.resolution[1]
+        self._error_frame = ERROR_FRAME_TEMPLATE.copy()
+        cv2.putText(self._error_frame, f"Connection Error: {self.name}", 
+                  (30, height//2 - 30), 
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        self._waiting_frame = _render_status_frame(self.resolution,
+                                                   [(f"Waiting for stream: {self.name}", 0)], (255, 255, 255))
+        
+    @property
+    def connected(self):
+        """Whether the stream is currently connected"""
+        return self._connected
+        
+    @connected.setter
+    def connected(self, value):
+        # Notify the owner on transitions so cached status can be invalidated
+        if value != self._connected:
+            self._connected = value
+            if self.on_status_change:
+                self.on_status_change()
         
     def connect(self):
         """Attempt to connect to the RTSP stream"""
         if self.cap is not None:
             self.cap.release()
             
-        # Use RTSP over TCP for more reliable streaming (reduces frame dropping)
-        os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp"
+        self.cap = None
         
-        # Set OpenCV capture properties for optimal streaming
-        self.cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)  # Small buffer size to reduce latency
+        # Prefer hardware decoding through PyAV; only a hardware failure disables it for this camera
+        if self._use_hwdecode:
+            try:
+                self.cap = HWDecodeCapture(self.url, CAPTURE_SETTINGS["hw_decode"], self.resolution)
+            except HWDecodeUnavailable as e:
+                print(f"Hardware decode unavailable for {self.name}, using OpenCV: {e}")
+                self._use_hwdecode = False
+            except Exception as e:
+                # Stream unreachable, timed out or stalled: an ordinary failed connect, retry on the GPU path
+                print(f"Error connecting to {self.name}: {e}")
+                self.connected = False
+                return False
+            
+        if self.cap is None:
+            # Use RTSP over TCP for more reliable streaming (reduces frame dropping)
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp"
+            
+            # Set OpenCV capture properties for optimal streaming
+            self.cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)  # Small buffer size to reduce latency
         
         if self.cap.isOpened():
+            # Only decode every Nth frame so we match the target capture rate
+            source_fps = self.cap.get(cv2.CAP_PROP_FPS)
+            if source_fps and source_fps > 0:
+                self.keep_every = max(1, int(source_fps // CAPTURE_SETTINGS["fps"]))
+            else:
+                self.keep_every = 1
             self.connected = True
             self.last_frame_time = time.time()
             return True
@@ -53,17 +143,6 @@ class Camera:
             self.connected = False
             return False
             
-    def load_detection_model(self):
-        """Load YOLOv8 detection model using the Ultralytics API"""
-        try:
-            # Use the Ultralytics YOLO API for model loading (handles torch.load internally)
-            self.detection_model = YOLO(DETECTION_SETTINGS["yolo_model"])
-            return True
-        except Exception as e:
-            print(f"Error loading detection model for {self.name}: {e}")
-            self.detection_model = None
-            return False
-            
     def start(self):
         """Start camera streaming thread"""
         if self.running:
@@ -74,17 +153,20 @@ class Camera:
         self.thread.daemon = True
         self.thread.start()
         
-        # Load detection model in separate thread to avoid blocking
-        if self.detection_enabled:
-            model_thread = threading.Thread(target=self.load_detection_model)
-            model_thread.daemon = True
-            model_thread.start()
+        # Overlay drawing runs separately so it never holds up frame acquisition
+        self.overlay_thread = threading.Thread(target=self._overlay_thread)
+        self.overlay_thread.daemon = True
+        self.overlay_thread.start()
             
     def stop(self):
         """Stop camera streaming thread"""
         self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
         if self.thread:
             self.thread.join(timeout=1.0)
+        if self.overlay_thread:
+            self.overlay_thread.join(timeout=1.0)
         if self.cap:
             self.cap.release()
         self.connected = False
@@ -105,128 +187,194 @@ class Camera:
                         time.sleep(self.reconnect_delay)
                         continue
                 else:
-                    # Create an error frame to show connection issue
-                    error_frame = np.zeros((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
-                    cv2.putText(error_frame, f"Connection Error: {self.name}", 
-                              (30, self.resolution[1]//2 - 30), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                    cv2.putText(error_frame, "Attempting to reconnect...", 
-                              (30, self.resolution[1]//2 + 30), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                    
+                    # Show the pre-rendered error frame for the connection issue
                     with self.lock:
-                        self.frame = error_frame.copy()
-                        self.processed_frame = error_frame.copy()
+                        self._latest = self._error_frame
+                    self._publish_processed(self._error_frame)
                     
                     time.sleep(self.reconnect_delay)
                     retry_count = 0  # Reset count and try again
                     continue
             
-            # Read frame from stream
-            success, frame = self.cap.read()
-            
-            if not success:
+            # Grab every packet to keep the stream drained; grab() paces to the stream rate
+            if not self.cap.grab():
                 self.connected = False
                 continue
                 
             # Update last frame time
             self.last_frame_time = time.time()
             
-            # Resize frame if needed
+            # Skip decoding frames we would throw away anyway
+            grab_index = self.grab_count
+            self.grab_count += 1
+            if grab_index % self.keep_every != 0:
+                continue
+                
+            success, frame = self.cap.retrieve()
+            
+            if not success:
+                self.connected = False
+                continue
+            
+            # Resize frame if needed; the output is a fresh array because published frames are shared
+            # (the PyAV decoder already scales to the target size, so only OpenCV capture hits this)
             if frame.shape[1] != self.resolution[0] or frame.shape[0] != self.resolution[1]:
                 frame = cv2.resize(frame, self.resolution)
                 
-            # Process frame with object detection if enabled
-            processed = frame.copy()
+            self._update_quality(frame)
             
-            if self.detection_enabled and self.detection_model and self.frame_count % self.refresh_interval == 0:
-                self._detect_objects(processed)
-            else:
-                # Draw existing detections on the frame
-                self._draw_detections(processed)
-                
-            # Store frames with thread safety
-            with self.lock:
-                self.frame = frame.copy()
-                self.processed_frame = processed.copy()
+            # Publish into the mailbox, overwriting any frame the overlay thread has not taken yet
+            with self._frame_cond:
+                # Frames are never mutated after publish, so readers can share the reference
+                self._latest = frame
+                self._latest_seq += 1
+                self._frame_cond.notify()
                 
             self.frame_count += 1
             
-            # Control the frame rate to avoid excessive CPU usage
-            time.sleep(1.0 / CAPTURE_SETTINGS["fps"])
-            
-    def _detect_objects(self, frame):
-        """Run object detection on the current frame"""
-        if not self.detection_model:
+    def _update_quality(self, frame):
+        """Pick the JPEG quality for this camera from the amount of motion in the scene"""
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        previous = self._motion_small
+        self._motion_small = small
+        if previous is None:
             return
             
-        try:
-            # Run YOLOv8 inference on the frame
-            results = self.detection_model(frame, conf=self.confidence_threshold)
-            
-            # Store the detection results
-            self.detections = []
+        motion = cv2.absdiff(previous, small).mean()
+        if motion > CAPTURE_SETTINGS["motion_high"]:
+            self._static_since = None
+            self.jpeg_quality = CAPTURE_SETTINGS["jpeg_quality_high"]
+        elif motion < CAPTURE_SETTINGS["motion_low"]:
+            # Only lower quality once the scene has stayed static for a while
+            now = time.time()
+            if self._static_since is None:
+                self._static_since = now
+            elif now - self._static_since >= CAPTURE_SETTINGS["motion_hold"]:
+                self.jpeg_quality = CAPTURE_SETTINGS["jpeg_quality_low"]
+        else:
+            self._static_since = None
+            self.jpeg_quality = CAPTURE_SETTINGS["jpeg_quality"]
             
-            for result in results:
-                boxes = result.boxes.cpu().numpy()
+    def _overlay_thread(self):
+        """Consume the latest decoded frame and publish it with detections drawn"""
+        last_seq = 0
+        
+        while self.running:
+            # Wait for a newer frame than the one we last processed
+            with self._frame_cond:
+                self._frame_cond.wait_for(lambda: self._latest_seq != last_seq or not self.running,
+                                          timeout=0.5)
+                if self._latest_seq == last_seq:
+                    continue
+                frame = self._latest
+                last_seq = self._latest_seq
                 
-                for i, box in enumerate(boxes):
-                    x1, y1, x2, y2 = box.xyxy[0].astype(int)
-                    confidence = float(box.conf[0])
-                    class_id = int(box.cls[0])
-                    class_name = result.names[class_id]
-                    
-                    self.detections.append({
-                        "bbox": (x1, y1, x2, y2),
-                        "confidence": confidence,
-                        "class_id": class_id,
-                        "class_name": class_name
-                    })
-                    
-            # Draw detections on the frame
-            self._draw_detections(frame)
-        except Exception as e:
-            print(f"Detection error on {self.name}: {e}")
+            # Draw the latest detections (updated by StreamManager.run_detection_batch)
+            # on a fresh copy; without detections the raw frame is published as-is
+            detections = self.detections
+            if self.detection_enabled and len(detections["bbox"]):
+                processed = frame.copy()
+                self._draw_detections(processed, detections)
+            else:
+                processed = frame
+                
+            self._publish_processed(processed)
+            
+    def _publish_processed(self, frame):
+        """Publish a processed frame and wake everyone waiting for it"""
+        with self._processed_cond:
+            self.processed_frame = frame
+            self.processed_seq += 1
+            self._processed_cond.notify_all()
+        if self.on_frame:
+            self.on_frame()
+            
+    def wait_for_frame(self, last_seq, timeout=None):
+        """
+        Wait until a processed frame newer than last_seq is published.
+        Returns (seq, frame), or (last_seq, None) on timeout.
+        """
+        with self._processed_cond:
+            if not self._processed_cond.wait_for(lambda: self.processed_seq != last_seq, timeout=timeout):
+                return last_seq, None
+            if self.processed_frame is None:
+                return self.processed_seq, self._waiting_frame
+            return self.processed_seq, self.processed_frame
+            
+    def needs_detection(self, frame):
+        """Check whether the frame differs enough from the last detected one to rerun YOLO"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, SCENE_SIZE, interpolation=cv2.INTER_AREA)
+        reference = self._ref_small
+        if reference is not None:
+            diff = np.abs(small.astype(np.int16) - reference).mean()
+            if diff < DETECTION_SETTINGS["scene_change_threshold"]:
+                # Scene unchanged: keep the previous detections
+                return False
+        self._pending_small = small
+        self._pending_generation = self._detection_generation
+        return True
+        
+    def update_detections(self, result):
+        """Store detections from a YOLOv8 result produced by a batched inference"""
+        # Settings changed while this batch ran (it may have used the old threshold): drop the
+        # result and leave the reference unset so the next batch detects again
+        if self._pending_generation != self._detection_generation:
+            return
             
-    def _draw_detections(self, frame):
+        boxes = result.boxes.cpu().numpy()
+        
+        # The batch runs at the lowest threshold of all cameras, filter to ours
+        keep = boxes.conf >= self.confidence_threshold
+        
+        # Swap in one assignment so the overlay thread never sees a partial update
+        self.detections = {
+            "bbox": boxes.xyxy[keep].astype(np.int32),
+            "conf": boxes.conf[keep].astype(np.float32),
+            "cls": boxes.cls[keep].astype(np.int32),
+            "names": result.names
+        }
+        # Later frames are compared against the frame these detections came from
+        self._ref_small = self._pending_small
+        
+    def _draw_detections(self, frame, detections):
         """Draw detection boxes and labels on the frame"""
-        for det in self.detections:
-            x1, y1, x2, y2 = det["bbox"]
-            label = f"{det['class_name']} {det['confidence']:.2f}"
+        bbox, conf, cls, names = detections["bbox"], detections["conf"], detections["cls"], detections["names"]
+        for i in range(len(bbox)):
+            x1, y1, x2, y2 = bbox[i].tolist()
             
             # Draw rectangle around the object
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            
-            # Draw filled rectangle for text background
-            text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
-            cv2.rectangle(frame, (x1, y1 - text_size[1] - 10), (x1 + text_size[0], y1), (0, 255, 0), -1)
+            draw_box(frame, x1, y1, x2, y2, 0, 255, 0, 2)
             
-            # Draw text label
-            cv2.putText(frame, label, (x1, y1 - 5), 
-                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+            # Paste the cached label (text on filled background) above the box
+            sprite = get_label_sprite(names[int(cls[i])], float(conf[i]))
+            paste_sprite(frame, sprite, x1, y1)
             
     def get_frame(self, with_detection=True):
-        """Get the current frame with thread safety"""
+        """Get the current frame with thread safety (shared reference, treat as read-only)"""
         with self.lock:
             if with_detection and self.processed_frame is not None:
-                return self.processed_frame.copy()
-            elif self.frame is not None:
-                return self.frame.copy()
+                return self.processed_frame
+            elif self._latest is not None:
+                return self._latest
             else:
-                # Return a blank frame if no frames are available
-                blank = np.zeros((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
-                cv2.putText(blank, f"Waiting for stream: {self.name}", 
-                          (30, self.resolution[1]//2), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                return blank
+                # Return the pre-rendered placeholder if no frames are available
+                return self._waiting_frame
                 
     def set_detection_enabled(self, enabled):
         """Enable or disable object detection"""
         self.detection_enabled = enabled
+        self._detection_generation += 1
+        if not enabled:
+            self.detections = EMPTY_DETECTIONS
+            self._ref_small = None
         
     def set_confidence_threshold(self, threshold):
         """Set confidence threshold for object detection"""
         self.confidence_threshold = threshold
+        # Force a fresh detection so the new threshold applies even on a static scene
+        self._detection_generation += 1
+        self._ref_small = None
         
     def is_connected(self):
         """Check if the camera is connected"""
@@ -241,8 +389,16 @@ class Camera:
     def take_snapshot(self, output_dir):
         """Save current frame as image snapshot"""
         os.makedirs(output_dir, exist_ok=True)
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
-        filename = f"{output_dir}/{self.name.replace(' ', '_')}_{timestamp}.jpg"
+        # Millisecond timestamps (plus a counter on collision) keep snapshot files immutable by name,
+        # which the long-lived browser caching of /snapshots/<filename> relies on
+        now = time.time()
+        timestamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+        base = f"{output_dir}/{self.name.replace(' ', '_')}_{timestamp}"
+        filename = f"{base}.jpg"
+        counter = 1
+        while os.path.exists(filename):
+            filename = f"{base}-{counter}.jpg"
+            counter += 1
         
         frame = self.get_frame(with_detection=True)
         if frame is not None:
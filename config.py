@@ -25,6 +25,13 @@ CAPTURE_SETTINGS = {
     "fps": 15,                 # Target frames per second
     "reconnect_delay": 5,      # Seconds to wait before reconnection attempt
     "retry_attempts": 5,       # Number of connection retry attempts
+    "hw_decode": "cuda",       # PyAV hardware decoder ("cuda", "vaapi") or None for OpenCV only
+    "jpeg_quality": 70,        # Default JPEG quality for streamed frames
+    "jpeg_quality_low": 50,    # Quality used once the scene has been static for motion_hold seconds
+    "jpeg_quality_high": 80,   # Quality used while there is a lot of motion
+    "motion_low": 3.0,         # Mean abs frame difference (0-255) below which a scene counts as static
+    "motion_high": 15.0,       # Mean abs frame difference above which a scene counts as active
+    "motion_hold": 2.0,        # Seconds a scene must stay static before lowering quality
 }
 
 # Object detection settings
@@ -32,8 +39,11 @@ DETECTION_SETTINGS = {
     "default_enabled": True,         # Enable detection by default
     "confidence_threshold": 0.5,     # Default confidence threshold
     "refresh_interval": 3,           # Frames between detections
+    "scene_change_threshold": 2.0,   # Mean gray-level change since the last detection needed to rerun YOLO
     "yolo_model": "yolov8n.pt",      # YOLOv8 model to use
-    "device": "cpu",                 # Use "cuda" for GPU acceleration if available
+    "device": "auto",                # "auto" picks "cuda" when available, else "cpu"
+    "export_model": True,            # Export to TensorRT FP16 (GPU) or ONNX (CPU) for faster inference
+    "image_size": 640,               # Inference/export image size
 }
 
 # Web application settings
@@ -41,6 +51,9 @@ APP_SETTINGS = {
     "host": "0.0.0.0",
     "port": 5000,
     "debug": False,
+    "allow_unsafe_werkzeug": False, # Opt in to serving `python app.py` from the Werkzeug development server
     "snapshot_dir": "snapshots",  # Directory to save snapshots
+    "snapshot_max_age": 31536000, # Browser cache lifetime for snapshots (immutable, timestamped names)
+    "use_x_sendfile": False,      # Let a front-end server (nginx/Apache) send snapshot files
     "socket_timeout": 60,         # Socket timeout in seconds
 } 
\ No newline at end of file
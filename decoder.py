@@ -0,0 +1,109 @@
+"""
+Hardware-accelerated RTSP decoding (NVDEC/VAAPI) through PyAV's FFmpeg bindings.
+"""
+import cv2
+
+# PyAV is optional; cameras fall back to cv2.VideoCapture without it
+try:
+    import av
+    from av.codec.hwaccel import HWAccel, hwdevices_available
+except ImportError:
+    av = None
+
+class HWDecodeUnavailable(RuntimeError):
+    """Hardware decoding cannot work on this machine (as opposed to the stream being unreachable)"""
+
+class HWDecodeCapture:
+    """
+    Minimal cv2.VideoCapture look-alike backed by a PyAV container with hardware decoding.
+    grab() decodes the next frame, retrieve() converts it to BGR only when the frame is kept.
+    If a resolution is given, scaling is fused into the same swscale pass as the conversion.
+    """
+    def __init__(self, url, device_type, resolution=None):
+        if av is None:
+            raise HWDecodeUnavailable("PyAV is not installed")
+
+        # Device types FFmpeg was not built with can never work on this machine
+        if device_type not in hwdevices_available():
+            raise HWDecodeUnavailable(f"{device_type} is not among FFmpeg's hardware devices")
+
+        # Disallow software fallback so a missing GPU surfaces as an error and we use OpenCV instead
+        try:
+            hwaccel = HWAccel(device_type=device_type, allow_software_fallback=False)
+        except Exception as e:
+            raise HWDecodeUnavailable(f"cannot create {device_type} hwaccel: {e}") from e
+
+        # The hardware device context is created inside av.open, so its errors arrive mixed with
+        # network/open errors; tell them apart by retrying the open without hardware acceleration
+        try:
+            self.container = av.open(url, options={"rtsp_transport": "tcp"}, timeout=10, hwaccel=hwaccel)
+        except av.error.FFmpegError as e:
+            if self._opens_without_hwaccel(url):
+                raise HWDecodeUnavailable(f"cannot open {device_type} device: {e}") from e
+            raise
+
+        self.stream = self.container.streams.video[0]
+        # PyAV silently decodes in software when the codec has no matching hardware config
+        if not self.stream.codec_context.is_hwaccel:
+            self.container.close()
+            raise HWDecodeUnavailable(f"{self.stream.codec_context.name} has no {device_type} decoder")
+
+        self.stream.thread_type = "AUTO"
+        self._frames = self.container.decode(self.stream)
+        self._frame = None
+        self.width, self.height = resolution if resolution else (None, None)
+
+        # Make sure frames actually flow; a slow or stalled stream is an ordinary failed connect
+        if not self.grab():
+            self.release()
+            raise ConnectionError("no frames received from stream")
+
+    @staticmethod
+    def _opens_without_hwaccel(url):
+        """Check whether the stream opens fine in software, i.e. the earlier failure was the hardware"""
+        try:
+            av.open(url, options={"rtsp_transport": "tcp"}, timeout=10).close()
+            return True
+        except av.error.FFmpegError:
+            return False
+
+    def isOpened(self):
+        """Check whether the container is open"""
+        return self.container is not None
+
+    def grab(self):
+        """Decode the next frame without converting it"""
+        try:
+            self._frame = next(self._frames)
+            return True
+        except (StopIteration, av.error.FFmpegError):
+            self._frame = None
+            return False
+
+    def retrieve(self):
+        """Convert the last grabbed frame to a BGR ndarray"""
+        if self._frame is None:
+            return False, None
+        return True, self._frame.to_ndarray(width=self.width, height=self.height, format="bgr24")
+
+    def read(self):
+        """Grab and retrieve in one call"""
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        """Return a capture property (only FPS is supported)"""
+        if prop == cv2.CAP_PROP_FPS and self.stream.average_rate:
+            return float(self.stream.average_rate)
+        return 0.0
+
+    def set(self, prop, value):
+        """Properties are not configurable on this backend"""
+        return False
+
+    def release(self):
+        """Close the container"""
+        if self.container is not None:
+            self.container.close()
+            self.container = None
@@ -0,0 +1,92 @@
+"""
+Detection overlay drawing: JIT-compiled box kernel and cached label sprites.
+"""
+import threading
+import cv2
+import numpy as np
+
+# Numba is optional; without it the box kernel falls back to numpy slicing
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.5
+LABEL_THICKNESS = 2
+LABEL_PADDING = 10
+
+_sprite_cache = {}
+_sprite_lock = threading.Lock()
+
+if njit is not None:
+    # Serial kernel: it is called concurrently from every camera's overlay thread, and a parallel
+    # region per box would cost more than the few hundred row segments it writes
+    @njit(cache=True)
+    def draw_box(img, x1, y1, x2, y2, b, g, r, thickness):
+        """Draw a rectangle outline in place on a BGR image"""
+        height, width = img.shape[0], img.shape[1]
+        x1 = max(x1, 0)
+        y1 = max(y1, 0)
+        x2 = min(x2, width - 1)
+        y2 = min(y2, height - 1)
+        for y in range(y1, y2 + 1):
+            if y < y1 + thickness or y > y2 - thickness:
+                # Top and bottom edges: fill the whole span
+                for x in range(x1, x2 + 1):
+                    img[y, x, 0] = b
+                    img[y, x, 1] = g
+                    img[y, x, 2] = r
+            else:
+                # Left and right edges only
+                for x in range(x1, min(x1 + thickness, x2 + 1)):
+                    img[y, x, 0] = b
+                    img[y, x, 1] = g
+                    img[y, x, 2] = r
+                for x in range(max(x2 - thickness + 1, x1), x2 + 1):
+                    img[y, x, 0] = b
+                    img[y, x, 1] = g
+                    img[y, x, 2] = r
+else:
+    def draw_box(img, x1, y1, x2, y2, b, g, r, thickness):
+        """Draw a rectangle outline in place on a BGR image"""
+        height, width = img.shape[0], img.shape[1]
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, width - 1), min(y2, height - 1)
+        if x1 > x2 or y1 > y2:
+            return
+        color = (b, g, r)
+        img[y1:min(y1 + thickness, y2 + 1), x1:x2 + 1] = color
+        img[max(y2 - thickness + 1, y1):y2 + 1, x1:x2 + 1] = color
+        img[y1:y2 + 1, x1:min(x1 + thickness, x2 + 1)] = color
+        img[y1:y2 + 1, max(x2 - thickness + 1, x1):x2 + 1] = color
+
+def get_label_sprite(class_name, confidence, color=(0, 255, 0)):
+    """Return a cached BGR label patch for a class name and confidence bucket"""
+    key = (class_name, round(confidence, 1), color)
+    sprite = _sprite_cache.get(key)
+    if sprite is not None:
+        return sprite
+
+    # Render once with OpenCV onto a small patch
+    label = f"{class_name} {key[1]:.1f}"
+    (text_w, text_h), _ = cv2.getTextSize(label, LABEL_FONT, LABEL_SCALE, LABEL_THICKNESS)
+    sprite = np.empty((text_h + LABEL_PADDING, text_w, 3), dtype=np.uint8)
+    sprite[:] = color
+    cv2.putText(sprite, label, (0, text_h + LABEL_PADDING - 5),
+                LABEL_FONT, LABEL_SCALE, (0, 0, 0), LABEL_THICKNESS)
+
+    with _sprite_lock:
+        _sprite_cache[key] = sprite
+    return sprite
+
+def paste_sprite(img, sprite, x, y):
+    """Copy a sprite onto the image with its bottom-left corner at (x, y), clipped to bounds"""
+    sprite_h, sprite_w = sprite.shape[:2]
+    top = y - sprite_h
+    # Clip the destination rectangle and the matching sprite region
+    dst_x1, dst_y1 = max(x, 0), max(top, 0)
+    dst_x2, dst_y2 = min(x + sprite_w, img.shape[1]), min(y, img.shape[0])
+    if dst_x1 >= dst_x2 or dst_y1 >= dst_y2:
+        return
+    img[dst_y1:dst_y2, dst_x1:dst_x2] = sprite[dst_y1 - top:dst_y2 - top, dst_x1 - x:dst_x2 - x]
@@ -53,8 +53,10 @@ socket.on('disconnect', () => {
     });
 });
 
-socket.on('camera_frame', (data) => {
-    updateCameraFrame(data.camera_name, data.frame, data.connected);
+socket.on('camera_frames_batch', (data) => {
+    for (const [cameraName, frameData] of Object.entries(data.frames)) {
+        updateCameraFrame(cameraName, frameData, data.connected[cameraName]);
+    }
 });
 
 socket.on('camera_status', (statusData) => {
@@ -70,10 +72,15 @@ function updateCameraFrame(cameraName, frameData, connected) {
         createCameraElement(cameraName);
     }
     
-    // Update frame
+    // Update frame from binary JPEG data, releasing the previous object URL
     const frameImg = document.querySelector(`.camera-container[data-camera="${cameraName}"] .camera-frame`);
     if (frameImg) {
-        frameImg.src = `data:image/jpeg;base64,${frameData}`;
+        const frameUrl = URL.createObjectURL(new Blob([frameData], { type: 'image/jpeg' }));
+        if (cameras[cameraName].frameUrl) {
+            URL.revokeObjectURL(cameras[cameraName].frameUrl);
+        }
+        cameras[cameraName].frameUrl = frameUrl;
+        frameImg.src = frameUrl;
     }
     
     // Update connection status
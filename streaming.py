@@ -1,13 +1,21 @@
 """
 Streaming utilities for camera feeds
 """
+import os
+import json
 import time
 import threading
 import cv2
 import numpy as np
-import base64
-from io import BytesIO
-from PIL import Image
+from ultralytics import YOLO
+from config import CAMERA_STREAMS, CAPTURE_SETTINGS, DETECTION_SETTINGS
+
+# Prefer libjpeg-turbo for JPEG encoding (SIMD accelerated), fall back to OpenCV
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420, TJPF_BGR
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
 
 class FrameProcessor:
     """Handles frame conversion between OpenCV and web formats"""
@@ -15,42 +23,194 @@ class FrameProcessor:
     @staticmethod
     def compress_frame(frame, quality=70):
         """Compress frame to JPEG bytes with specified quality"""
+        if _tj is not None:
+            return _tj.encode(frame, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420)
+            
         success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
         if not success:
             return None
         return buffer.tobytes()
     
     @staticmethod
-    def frame_to_base64(frame, quality=70):
-        """Convert OpenCV frame to base64 encoded JPEG for web display"""
+    def frame_to_jpeg_bytes(frame, quality=70):
+        """Convert OpenCV frame to raw JPEG bytes for binary SocketIO emission"""
         if frame is None:
             return None
-            
-        compressed = FrameProcessor.compress_frame(frame, quality)
-        if compressed is None:
-            return None
-            
-        return base64.b64encode(compressed).decode('utf-8')
+        return FrameProcessor.compress_frame(frame, quality)
     
     @staticmethod
     def frame_to_jpeg_response(frame, quality=70):
         """Convert OpenCV frame to JPEG bytes for HTTP response"""
-        compressed = FrameProcessor.compress_frame(frame, quality)
-        if compressed is None:
-            return None
-        return compressed
+        return FrameProcessor.compress_frame(frame, quality)
 
 class StreamManager:
     """Manages multiple camera streams with thread safety"""
     
+    # One detection model per process, shared by every manager; the lock makes sure it is
+    # loaded and warmed up only once
+    shared_model = None
+    inference_kwargs = {}
+    _model_lock = threading.Lock()
+    
     def __init__(self):
         self.cameras = {}
+        # Immutable snapshot of the cameras, rebuilt on add/remove and safe to read without the lock
+        self._cameras_snapshot = ()
         self.lock = threading.Lock()
+        # Serialized camera status, rebuilt only after a status field changes
+        self._status = {}
+        self._status_cache = b"{}"
+        self._status_dirty = True
+        self.status_version = 0
+        # Set by any camera publishing a frame, consumed by the emit loop
+        self.frame_event = threading.Event()
+        # Snapshot listing kept in memory, keyed by filename
+        self._snapshot_index = {}
+        
+        # Load the single shared detection model in a separate thread to avoid blocking
+        model_thread = threading.Thread(target=self.load_detection_model)
+        model_thread.daemon = True
+        model_thread.start()
+        
+        # Batched detection runs on its own thread so it never stalls frame emission
+        self.detection_running = True
+        self.detection_thread = threading.Thread(target=self._detection_loop)
+        self.detection_thread.daemon = True
+        self.detection_thread.start()
+    
+    @staticmethod
+    def _resolve_device():
+        """Resolve the configured detection device to cuda or cpu"""
+        device = DETECTION_SETTINGS["device"]
+        if device == "cpu":
+            return "cpu"
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return "cuda"
+        except ImportError:
+            pass
+        return "cpu"
+    
+    @staticmethod
+    def _export_model(weights, export_format, **kwargs):
+        """Export the model once and return the exported path, reusing a previous export"""
+        # Exports take batches of frames from every camera, so the input shape must be dynamic.
+        # The settings go into the file name so a stale static export is never picked up.
+        kwargs["dynamic"] = True
+        if export_format == "engine":
+            kwargs["batch"] = len(CAMERA_STREAMS)
+        suffix = f"_dyn{kwargs.get('batch', '')}_{DETECTION_SETTINGS['image_size']}"
+        if kwargs.get("half"):
+            suffix += "_fp16"
+        exported = os.path.splitext(weights)[0] + suffix + (".engine" if export_format == "engine" else ".onnx")
+        
+        if not os.path.exists(exported):
+            output = YOLO(weights).export(format=export_format,
+                                          imgsz=DETECTION_SETTINGS["image_size"], **kwargs)
+            os.replace(output, exported)
+        return exported
+    
+    def _build_exported_model(self, weights, device):
+        """Create the YOLO model on an exported backend (TensorRT FP16 on GPU, ONNX Runtime on CPU)"""
+        if device == "cuda":
+            exported = self._export_model(weights, "engine", half=True, device=0)
+        else:
+            exported = self._export_model(weights, "onnx")
+        return YOLO(exported, task="detect")
+    
+    def _warm_up(self, model):
+        """Run one batch the size of the camera count so graph/engine setup and the batch shape are exercised"""
+        width, height = CAPTURE_SETTINGS["resolution"]
+        frames = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(max(1, len(CAMERA_STREAMS)))]
+        model(frames, verbose=False, imgsz=DETECTION_SETTINGS["image_size"], **self.inference_kwargs)
+    
+    def load_detection_model(self):
+        """Load and warm up the YOLOv8 detection model shared by all cameras (once)"""
+        with StreamManager._model_lock:
+            if StreamManager.shared_model is not None:
+                return True
+                
+            weights = DETECTION_SETTINGS["yolo_model"]
+            device = self._resolve_device()
+            
+            if device == "cuda":
+                StreamManager.inference_kwargs = {"device": 0, "half": True}
+            else:
+                StreamManager.inference_kwargs = {"device": "cpu"}
+            
+            # Prefer the exported backend; any export, load or warmup failure falls back to eager PyTorch
+            if DETECTION_SETTINGS["export_model"]:
+                try:
+                    model = self._build_exported_model(weights, device)
+                    self._warm_up(model)
+                    # Publish only after warmup so run_detection_batch never sees a cold model
+                    StreamManager.shared_model = model
+                    return True
+                except Exception as e:
+                    print(f"Error loading exported detection model, using {weights}: {e}")
+            
+            try:
+                # Use the Ultralytics YOLO API for model loading (handles torch.load internally)
+                model = YOLO(weights)
+                self._warm_up(model)
+                StreamManager.shared_model = model
+                return True
+            except Exception as e:
+                print(f"Error loading detection model: {e}")
+                StreamManager.shared_model = None
+                return False
+    
+    def _detection_loop(self):
+        """Run batched detection at the cadence the cameras used to run it individually"""
+        detection_interval = DETECTION_SETTINGS["refresh_interval"] / CAPTURE_SETTINGS["fps"]
+        while self.detection_running:
+            start_time = time.time()
+            self.run_detection_batch()
+            # A slow batch simply delays the next one; never run back-to-back faster than the interval
+            remaining = detection_interval - (time.time() - start_time)
+            if remaining > 0:
+                time.sleep(remaining)
+    
+    def run_detection_batch(self):
+        """Run one batched inference over the latest frame of every detection-enabled camera"""
+        if self.shared_model is None:
+            return
+            
+        # Only send frames whose scene changed since that camera's last detection
+        cameras = []
+        frames = []
+        for camera in self.get_all_cameras_fast():
+            if not camera.detection_enabled or not camera.is_connected():
+                continue
+            frame = camera.get_frame(with_detection=False)
+            if camera.needs_detection(frame):
+                cameras.append(camera)
+                frames.append(frame)
+        if not cameras:
+            return
+            
+        min_conf = min(camera.confidence_threshold for camera in cameras)
+        
+        try:
+            results = self.shared_model(frames, conf=min_conf, verbose=False,
+                                        imgsz=DETECTION_SETTINGS["image_size"], **self.inference_kwargs)
+        except Exception as e:
+            print(f"Batched detection error: {e}")
+            return
+            
+        # Route each result back to the camera it came from
+        for camera, result in zip(cameras, results):
+            camera.update_detections(result)
     
     def add_camera(self, camera):
         """Add a camera to the manager"""
         with self.lock:
             self.cameras[camera.name] = camera
+            self._cameras_snapshot = tuple(self.cameras.values())
+            camera.on_status_change = self.mark_status_dirty
+            camera.on_frame = self.frame_event.set
+            self._status_dirty = True
             camera.start()
     
     def remove_camera(self, camera_name):
@@ -58,7 +218,11 @@ class StreamManager:
         with self.lock:
             if camera_name in self.cameras:
                 self.cameras[camera_name].stop()
+                self.cameras[camera_name].on_status_change = None
+                self.cameras[camera_name].on_frame = None
                 del self.cameras[camera_name]
+                self._cameras_snapshot = tuple(self.cameras.values())
+                self._status_dirty = True
     
     def get_camera(self, camera_name):
         """Get a camera by name"""
@@ -70,6 +234,10 @@ class StreamManager:
         with self.lock:
             return list(self.cameras.values())
     
+    def get_all_cameras_fast(self):
+        """Get all cameras as a cached tuple, without taking the lock"""
+        return self._cameras_snapshot
+    
     def get_camera_names(self):
         """Get all camera names"""
         with self.lock:
@@ -82,28 +250,54 @@ class StreamManager:
                 camera.start()
     
     def stop_all(self):
-        """Stop all cameras"""
+        """Stop all cameras and the detection thread"""
+        self.detection_running = False
         with self.lock:
             for camera in self.cameras.values():
                 camera.stop()
     
-    def get_camera_status(self):
-        """Get status of all cameras"""
+    def mark_status_dirty(self):
+        """Invalidate the cached camera status"""
+        self._status_dirty = True
+    
+    def _refresh_status(self):
+        """Rebuild the cached status if anything changed (caller holds the lock)"""
+        # Evaluate connection timeouts first, they may flip the dirty flag
+        for camera in self.cameras.values():
+            camera.is_connected()
+        if not self._status_dirty:
+            return
+            
+        self._status_dirty = False
         status = {}
+        for name, camera in self.cameras.items():
+            status[name] = {
+                "connected": camera.connected,
+                "detection_enabled": camera.detection_enabled,
+                "confidence_threshold": camera.confidence_threshold
+            }
+        self._status = status
+        self._status_cache = json.dumps(status).encode('utf-8')
+        self.status_version += 1
+    
+    def get_camera_status(self):
+        """Get status of all cameras (shared cached dict, treat as read-only)"""
+        with self.lock:
+            self._refresh_status()
+            return self._status
+    
+    def get_camera_status_json(self):
+        """Get status of all cameras as cached JSON bytes"""
         with self.lock:
-            for name, camera in self.cameras.items():
-                status[name] = {
-                    "connected": camera.is_connected(),
-                    "detection_enabled": camera.detection_enabled,
-                    "confidence_threshold": camera.confidence_threshold
-                }
-        return status
+            self._refresh_status()
+            return self._status_cache
     
     def set_detection_enabled(self, camera_name, enabled):
         """Enable or disable detection for a camera"""
         with self.lock:
             if camera_name in self.cameras:
                 self.cameras[camera_name].set_detection_enabled(enabled)
+                self._status_dirty = True
                 return True
         return False
     
@@ -112,12 +306,43 @@ class StreamManager:
         with self.lock:
             if camera_name in self.cameras:
                 self.cameras[camera_name].set_confidence_threshold(threshold)
+                self._status_dirty = True
                 return True
         return False
     
+    @staticmethod
+    def _snapshot_entry(filename, timestamp):
+        """Build a snapshot listing entry"""
+        return {
+            'filename': filename,
+            'timestamp': timestamp,
+            'url': f'/snapshots/{filename}'
+        }
+    
+    def load_snapshot_index(self, snapshot_dir):
+        """Build the snapshot index with a single directory scan"""
+        index = {}
+        if os.path.exists(snapshot_dir):
+            with os.scandir(snapshot_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.jpg') and entry.is_file():
+                        index[entry.name] = self._snapshot_entry(entry.name, entry.stat().st_mtime)
+        with self.lock:
+            self._snapshot_index = index
+    
+    @property
+    def snapshot_index(self):
+        """List of all saved snapshots"""
+        with self.lock:
+            return list(self._snapshot_index.values())
+    
     def take_snapshot(self, camera_name, output_dir):
         """Take a snapshot from a camera"""
         with self.lock:
             if camera_name in self.cameras:
-                return self.cameras[camera_name].take_snapshot(output_dir)
+                snapshot_path = self.cameras[camera_name].take_snapshot(output_dir)
+                if snapshot_path:
+                    filename = os.path.basename(snapshot_path)
+                    self._snapshot_index[filename] = self._snapshot_entry(filename, time.time())
+                return snapshot_path
         return None 
\ No newline at end of file